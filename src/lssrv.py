@@ -24,23 +24,58 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 
 import os
+import re
+import sys
+import time
 import logging
+import argparse
+import contextlib
 import subprocess
 
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import configparser
 
-# Rich related imports come here.
-from rich.console import Console
-from rich.table import Table
-from rich.markdown import Markdown
+# Rich is imported only when we draw to a terminal. Importing it is the most expensive part of our startup, and it's useless when the output is piped.
+
+# pyslurm is optional. If it's there, we talk to Slurm directly instead of running scontrol.
+try:
+	import pyslurm
+except ImportError:
+	pyslurm = None
+
+# These are the only scontrol properties we use. Everything else is dropped while parsing.
+PARTITION_PROPERTIES_TO_KEEP = frozenset(['PartitionName', 'Nodes', 'TotalCPUs', 'TotalNodes', 'MaxTime', 'MinNodes', 'MaxNodes', 'DefMemPerCPU'])
+
+# Some of these depend on the partition configuration, e.g. DefMemPerCPU is missing when DefMemPerNode is used. These are shown as '-' when missing.
+PARTITION_PROPERTIES_OPTIONAL = frozenset(['Nodes', 'MaxTime', 'MinNodes', 'MaxNodes', 'DefMemPerCPU'])
+
+# Matches a single "Name=Value" pair in scontrol's one line output. Values can contain '=' too, e.g. TRES=cpu=4,mem=8G.
+SCONTROL_PROPERTY_PATTERN = re.compile(r'([A-Za-z][A-Za-z0-9_]*)=(\S*)')
+
+# Same properties, as named in the dictionaries returned by pyslurm.
+PYSLURM_PROPERTY_NAMES = {'PartitionName': 'name', 'Nodes': 'nodes', 'TotalCPUs': 'total_cpus', 'TotalNodes': 'total_nodes', 'MaxTime': 'max_time_str', 'MinNodes': 'min_nodes', 'MaxNodes': 'max_nodes', 'DefMemPerCPU': 'def_mem_per_cpu'}
+
+# If enabled, scontrol output is cached here for a few seconds, so repeated lssrv runs of a user share a single scontrol call.
+# scontrol only shows the partitions a user can access, so the cache is per user and can't be shared between users.
+SCONTROL_COMMAND = ['scontrol', 'show', 'partition', '-o']
+SCONTROL_CACHE_FILE_PATH = '/dev/shm/lssrv-' + str(os.getuid()) + '.scontrol.cache'
+SCONTROL_CACHE_LOCK_PATH = '/dev/shm/lssrv-' + str(os.getuid()) + '.scontrol.lock'
+SCONTROL_CACHE_LOCK_TIMEOUT = 2 # In seconds. A scontrol call normally takes much less.
+
+# Table columns and their justification. Plain output uses the same headers on a single line.
+TABLE_COLUMNS = [('Partition\nName', 'left'), ('CPUs\n(Free)', 'left'), ('CPUs\n(Total)', 'left'), ('Wait. Jobs\n(Resource)', 'left'), ('Wait. Jobs\n(Total)', 'left'), ('Nodes\n(Total)', 'left'), ('Max Job Time\nDD-HH:MM:SS', 'right'), ('Min. Nodes\nPer Job', 'right'), ('Max. Nodes\nPer Job', 'right'), ('Core\nper Node', 'left'), ('RAM\nper Core', 'left')]
 
 class Partition:
 	'''
 	@summary: This object contains every partition in the cluster and every detail accessible by the user.
 	'''
 	
+	# We create one of these per partition. Slots keep them small, and the scontrol properties live in _props anyway.
+	__slots__ = ('_props', 'PartitionName', 'pendingJobsPerCategory', 'pendingJobsTotal', 'busyCPUCount', 'homogenous', 'totalCPUCount', 'totalNodeCount', 'coresPerNode')
+	
 	def __init__ (self):
 		''' Default constructor for the class.'''
 		pass
@@ -48,53 +83,201 @@ class Partition:
 	def __init__ (self, scontrolOutputString):
 		'''A constructor which gets the scontrol output and initializes the class.'''
 		
-		# Get a class wide logger.
+		# Decode the whole line once, tokenize it in a single regex scan, and keep only the properties we show in a plain dictionary.
+		propertyNamesAndValues = SCONTROL_PROPERTY_PATTERN.findall(scontrolOutputString.decode('utf-8', 'replace'))
+		propertiesToKeep = {name: value for name, value in propertyNamesAndValues if name in PARTITION_PROPERTIES_TO_KEEP}
+		
+		self._setProperties(propertiesToKeep)
+	
+	@classmethod
+	def fromPyslurm (cls, pyslurmPartition):
+		'''An alternative constructor which gets a partition dictionary from pyslurm and initializes the class.'''
+		
+		# pyslurm uses its own key names. Translate them to the scontrol ones, so the rest of the code doesn't care where the data came from.
+		# Missing or None values are left out here, and the optional ones are shown as '-' later.
+		propertiesToKeep = {name: str(pyslurmPartition[key]) for name, key in PYSLURM_PROPERTY_NAMES.items() if pyslurmPartition.get(key) is not None}
+		
+		# Skip __init__, there's nothing to parse.
+		partition = cls.__new__(cls)
+		partition._setProperties(propertiesToKeep)
+		
+		return partition
+	
+	def _setProperties (self, propertiesToKeep):
+		'''Store the partition properties and initialize the partition load variables.'''
+		
 		logger = logging.getLogger('Partition_class')
 		
-		# and create an intermediate string for processing partition properties.
-		partitionPropertyBundle = scontrolOutputString.split(b' ')
+		self._props = propertiesToKeep
 		
-		# Will fill properties to a dictionary and will transfer to variables then.
-		for property in partitionPropertyBundle:
-			
-			logger.debug('Processing feature: ' + str(property))
-			
-			# Extract the property name and value.
-			propertyNameAndValue = property.split(b'=')
-			
-			# Directly create a new variable with the string coming from the property list.
-			setattr(self, propertyNameAndValue[0].decode('utf-8'), propertyNameAndValue[1].decode('utf-8'))
+		for name in PARTITION_PROPERTIES_OPTIONAL:
+			self._props.setdefault(name, '-')
 		
-		logger.debug('Extracted partition properties: ' + str(dir(self)))
+		# This one is used as a key everywhere, so keep it as a real attribute.
+		self.PartitionName = self._props['PartitionName']
 		
-		# Also, create partition load variables
-		self.pendingJobsPerCategory = dict()
-		self.pendingJobsPerCategory['Resources'] = 0 # We will query this anyway, and sometimes there are no pending jobs, so its absence creates problems.
+		logger.debug('Extracted partition properties: %s', self._props)
+		
+		# Also, create partition load variables
+		self.pendingJobsPerCategory = defaultdict(int) # Missing reasons count as 0, no need to initialize them.
 		self.pendingJobsTotal = 0 # Storing total here allows us to gain some important performance while showing the table.
 		self.busyCPUCount = 0
 		
 		# Check whether partition has more than one type of servers.
 		# TODO: Fix this code. If there are two chunks of same server type, it makes mistakes.
-		serverTypes = self.Nodes.split(',')
-			
-		if len(serverTypes) > 1:
+		if ',' in self._props['Nodes']:
 			logger.debug('Partition has more than one server type.')
 			self.homogenous = False
 		else:
 			logger.debug('Partition has one server type.')
 			self.homogenous = True
 		
+		# These are needed as numbers while rendering, convert them once here.
+		self.totalCPUCount = int(self._props['TotalCPUs'])
+		self.totalNodeCount = int(self._props['TotalNodes'])
+		
+		# A partition without nodes has no meaningful core count per node either.
+		if self.homogenous and self.totalNodeCount > 0:
+			self.coresPerNode = str(self.totalCPUCount // self.totalNodeCount)
+		else:
+			self.coresPerNode = '-'
+	
+	def __getattr__ (self, name):
+		'''Serve the scontrol properties we keep as regular attributes.'''
+		
+		# Bypass ourselves while getting _props, otherwise a missing _props would recurse here forever.
+		try:
+			return object.__getattribute__(self, '_props')[name]
+		except KeyError:
+			raise AttributeError(name)
+	
+
+def readScontrolCache(cacheTimeToLive):
+	''' This function returns the cached scontrol output if it's ours and younger than cacheTimeToLive seconds, None otherwise.'''
+	
+	logger = logging.getLogger('readScontrolCache')
+	
+	# /dev/shm is writable by everyone. Don't follow links, and don't trust files we didn't write.
+	try:
+		cacheFileDescriptor = os.open(SCONTROL_CACHE_FILE_PATH, os.O_RDONLY | os.O_NOFOLLOW)
+		
+		try:
+			cacheFileStatus = os.fstat(cacheFileDescriptor)
+			
+			if cacheFileStatus.st_uid != os.getuid() or time.time() - cacheFileStatus.st_mtime >= cacheTimeToLive:
+				logger.debug('scontrol cache is stale or not ours, ignoring it.')
+				return None
+			
+			return os.read(cacheFileDescriptor, cacheFileStatus.st_size)
+		finally:
+			os.close(cacheFileDescriptor)
+	except OSError as exception:
+		logger.debug('Cannot read scontrol cache: %s', exception)
+		return None
+
+def writeScontrolCache(scontrolOutput):
+	''' This function atomically replaces the scontrol cache with the given output. Failing to do so is not fatal.'''
+	
+	logger = logging.getLogger('writeScontrolCache')
+	
+	# Only needed when the cache is enabled, which is not the default. Don't make every run pay for importing it.
+	import tempfile
+	
+	try:
+		temporaryFileDescriptor, temporaryFilePath = tempfile.mkstemp(dir = os.path.dirname(SCONTROL_CACHE_FILE_PATH), prefix = '.lssrv-')
+	except OSError as exception:
+		logger.debug('Cannot create scontrol cache: %s', exception)
+		return
+	
+	try:
+		with os.fdopen(temporaryFileDescriptor, 'wb') as temporaryFile:
+			temporaryFile.write(scontrolOutput)
+		
+		os.replace(temporaryFilePath, SCONTROL_CACHE_FILE_PATH)
+	except OSError as exception:
+		logger.debug('Cannot write scontrol cache: %s', exception)
+		os.unlink(temporaryFilePath)
 
-def getAllPartitions():
+def acquireScontrolCacheLock(lockFileDescriptor):
+	''' This function tries to lock the scontrol cache for SCONTROL_CACHE_LOCK_TIMEOUT seconds at most. Returns True if the lock is acquired.'''
+	
+	# Only needed when the cache is enabled, which is not the default. Don't make every run pay for importing it.
+	import fcntl
+	
+	lockDeadline = time.monotonic() + SCONTROL_CACHE_LOCK_TIMEOUT
+	
+	while True:
+		try:
+			fcntl.flock(lockFileDescriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			return True
+		except BlockingIOError:
+			if time.monotonic() >= lockDeadline:
+				return False
+			
+			time.sleep(0.05)
+
+def getScontrolOutput(cacheTimeToLive):
+	''' This function returns the output of scontrol, from the cache if it's fresh enough. A cacheTimeToLive of 0 disables the cache.'''
+	
+	logger = logging.getLogger('getScontrolOutput')
+	
+	if cacheTimeToLive <= 0:
+		return subprocess.check_output(SCONTROL_COMMAND)
+	
+	try:
+		lockFileDescriptor = os.open(SCONTROL_CACHE_LOCK_PATH, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+	except OSError as exception:
+		logger.debug('Cannot open scontrol cache lock, not using the cache: %s', exception)
+		return subprocess.check_output(SCONTROL_COMMAND)
+	
+	try:
+		# Anybody can create this file before us and hold a lock on it. Only use a lock file we own.
+		if os.fstat(lockFileDescriptor).st_uid != os.getuid():
+			logger.debug('scontrol cache lock is not ours, not using the cache.')
+			return subprocess.check_output(SCONTROL_COMMAND)
+		
+		# Concurrent invocations wait here, then reuse what the first one has written instead of calling scontrol again.
+		# Never wait forever though. If the lock doesn't come in a reasonable time, just ask scontrol ourselves.
+		if not acquireScontrolCacheLock(lockFileDescriptor):
+			logger.debug('Cannot lock scontrol cache in time, not using the cache.')
+			return subprocess.check_output(SCONTROL_COMMAND)
+		
+		scontrolOutput = readScontrolCache(cacheTimeToLive)
+		
+		if scontrolOutput is None:
+			scontrolOutput = subprocess.check_output(SCONTROL_COMMAND)
+			writeScontrolCache(scontrolOutput)
+		else:
+			logger.debug('Using cached scontrol output.')
+		
+		return scontrolOutput
+	finally:
+		# Closing the file releases the lock too.
+		os.close(lockFileDescriptor)
+
+def getAllPartitions(scontrolCacheTimeToLive = 0):
 	''' This functions ask Slurm for all partitions, then creates & returns several partition objects in a dictionary.'''
 	
 	logger = logging.getLogger('getAllPartitions')
 	
+	# If we have pyslurm, ask libslurm directly. This saves us a fork/exec and the text parsing.
+	if pyslurm is not None:
+		try:
+			pyslurmPartitions = pyslurm.partition().get()
+			partitionsDict = {partitionName: Partition.fromPyslurm(partitionProperties) for partitionName, partitionProperties in pyslurmPartitions.items()}
+		except (AttributeError, KeyError, TypeError, ValueError) as exception:
+			# pyslurm reports Slurm errors as ValueError. Other pyslurm versions may lack the partition class or use other keys.
+			# scontrol may still work in all of these cases, so don't give up yet.
+			logger.error('Cannot get partitions via pyslurm, falling back to scontrol: %r', exception)
+		else:
+			logger.info('Have read %d partition(s) via pyslurm.', len(partitionsDict))
+			return partitionsDict
+	
 	# Get the partitions directly from Slurm.
 	# Line is ending with \n. Always strip before splitting.
-	partitions = subprocess.check_output(['scontrol', 'show', 'partition', '-o']).strip().split(b'\n')
+	partitions = getScontrolOutput(scontrolCacheTimeToLive).strip().split(b'\n')
 	
-	logger.info('Have read ' + str(len(partitions)) + ' partition(s).')
+	logger.info('Have read %d partition(s).', len(partitions))
 	
 	# Create a list for storing partition objects.
 	partitionsDict = dict()
@@ -103,61 +286,120 @@ def getAllPartitions():
 		tempPartition = Partition(partition)
 		partitionsDict[tempPartition.PartitionName] = tempPartition
 	
-	logger.debug('Returning ' + str(len(partitions)) + ' partition(s).')
+	logger.debug('Returning %d partition(s).', len(partitions))
 	return partitionsDict
 
-def getJobStateForPartitions(partitions, partitionsToIgnore, queueStateFilePath):
-	''' This function gets all the jobs and updates the job state information per partition.'''
+def readQueueState(queueStateFilePath):
+	''' This function reads the squeue state file in one go. Returns the contents and the modification time of the file, or (None, None) if the file cannot be read.'''
 	
-	logger = logging.getLogger('getJobStateForPartitions')
+	logger = logging.getLogger('readQueueState')
 	
 	# This is a very expensive command in terms of time. Calling it once and processing more is much more preferable to calling it 10+ times.
-	if os.path.exists(queueStateFilePath):
-		queueState = open(queueStateFilePath, 'r')
-		jobsInTheCluster = queueState.readlines()
-		queueState.close()
-	
-	#TODO: Add exception handling here. Sometimes previous command returns nothing. 
-	for job in jobsInTheCluster:
-		splittedLine = job.split()
-		jobPartition = splittedLine[0].strip()
-		jobCoreCount = splittedLine[1].strip()
-		jobState = splittedLine[2].strip()
-		jobReason = splittedLine[3].strip()
-
-		# If the partition is in the ignore list, just move along. There's nothing to see/do here.
-		if jobPartition in partitionsToIgnore:
-			continue
-		
-		# Sometimes a user has no access to a partition, but we have the information anyways, and it creates problems.
-		if jobPartition not in partitions:
-			continue
-
-		# Parse the job state and fill relevant information accordingly.
-		if jobState == 'RUNNING':
-			logger.debug('Job is running with ' + jobCoreCount + 'core(s) on partition ' + jobPartition + '.')
-			partitions[jobPartition].busyCPUCount = partitions[jobPartition].busyCPUCount + int(jobCoreCount)
-		
-		elif jobState == 'PENDING':
-			logger.debug('Job is running with ' + jobCoreCount + 'core(s) on partition ' + jobPartition + ', because of ' + jobReason + '.')
-			
-			# Let's check whether whether we already have a counter for the reason at hand. If not, create one.
-			if jobReason in partitions[jobPartition].pendingJobsPerCategory:
-				logger.debug('Incrementing key ' + jobReason + ' for partition ' + jobPartition + ' by 1.')
-				partitions[jobPartition].pendingJobsPerCategory[jobReason] = partitions[jobPartition].pendingJobsPerCategory[jobReason] + 1 
-			else:
-				logger.debug('Creating key ' + jobReason + ' for partition ' + jobPartition + ' and setting it to 1.')
-				partitions[jobPartition].pendingJobsPerCategory[jobReason] = 1
-				
-			# This needs to be incremented anyway:
-			partitions[jobPartition].pendingJobsTotal = partitions[jobPartition].pendingJobsTotal + 1
+	# Both the cron helper and lssrv_cache.py replace the state file atomically, so we can read it in one go without locking.
+	# Just try to open it instead of checking its existence first. It's one less syscall, and the file can't vanish in between.
+	try:
+		queueStateFileDescriptor = os.open(queueStateFilePath, os.O_RDONLY)
+		
+		try:
+			queueStateFileStatus = os.fstat(queueStateFileDescriptor)
+			queueState = os.read(queueStateFileDescriptor, queueStateFileStatus.st_size)
+		finally:
+			os.close(queueStateFileDescriptor)
+	except OSError as exception:
+		logger.error('Cannot read squeue state file: %s', exception)
+		return None, None
+	
+	logger.debug('Have read %d byte(s) of squeue state.', len(queueState))
+	return queueState, queueStateFileStatus.st_mtime
+
+def getJobStateForPartitions(partitions, partitionsToIgnore, queueState):
+	''' This function gets all the jobs from the squeue state read by readQueueState() and updates the job state information per partition.'''
+	
+	logger = logging.getLogger('getJobStateForPartitions')
+	
+	jobsInTheCluster = queueState.decode('utf-8', 'replace').splitlines()
+	
+	# Split every job once, and drop the ones we don't care about in a single pass.
+	# If the partition is in the ignore list, there's nothing to see/do here.
+	# Sometimes a user has no access to a partition, but we have the information anyways, and it creates problems.
+	partitionsToIgnore = set(partitionsToIgnore)
+	splittedJobs = (job.split() for job in jobsInTheCluster)
+	relevantJobs = [job for job in splittedJobs if len(job) >= 4 and job[0] in partitions and job[0] not in partitionsToIgnore]
+	
+	# Group the jobs by partition (and reason for pending ones), instead of updating partition objects per job.
+	busyCPUsPerPartition = Counter()
+	
+	for job in relevantJobs:
+		if job[2] == 'RUNNING':
+			busyCPUsPerPartition[job[0]] += int(job[1])
+	
+	pendingJobsPerPartitionAndReason = Counter((job[0], job[3]) for job in relevantJobs if job[2] == 'PENDING')
+	
+	logger.debug('Found %d job(s) on %d partition(s).', len(relevantJobs), len(partitions))
+	
+	# Now, push the grouped results back into the partitions. This loop is as long as the partition count at most.
+	for jobPartition, busyCPUCount in busyCPUsPerPartition.items():
+		logger.debug('Partition %s has %d busy core(s).', jobPartition, busyCPUCount)
+		partitions[jobPartition].busyCPUCount = busyCPUCount
+	
+	for (jobPartition, jobReason), pendingJobCount in pendingJobsPerPartitionAndReason.items():
+		logger.debug('Partition %s has %d job(s) pending because of %s.', jobPartition, pendingJobCount, jobReason)
+		
+		# Look the partition up once, and work on the local reference.
+		partition = partitions[jobPartition]
+		partition.pendingJobsPerCategory[jobReason] += pendingJobCount
+		
+		# This needs to be incremented anyway:
+		partition.pendingJobsTotal += pendingJobCount
 			
+def formatLastUpdateTime(stateFileLastUpdateTime):
+	''' This function returns the state file update time as a human readable string.'''
+	
+	# If we couldn't read the state file, the table only shows the partitions. Make this visible.
+	if stateFileLastUpdateTime is None:
+		return 'Unknown, queue state is not available.'
+	
+	return datetime.fromtimestamp(stateFileLastUpdateTime).strftime('%Y-%m-%d %H:%M:%S')
+
+def renderPlain(rows, headers, stateFileLastUpdateTime):
+	''' This function prints the rows as tab separated lines, which is friendly to grep, cut, awk and friends. The update time goes to stderr, so stdout only has the header and the rows.'''
+	
+	print('\t'.join(header.replace('\n', ' ') for header in headers))
+	
+	for row in rows:
+		print('\t'.join(row))
+	
+	print('Last update: ' + formatLastUpdateTime(stateFileLastUpdateTime), file = sys.stderr)
+
+def renderRich(console, rows, columns, stateFileLastUpdateTime):
+	''' This function draws the rows as a Rich table, followed by the state file update time.'''
+	
+	from rich.table import Table
+	from rich.markdown import Markdown
+	
+	# Let's start building our table.
+	table = Table(title = 'TRUBA Partitions State')
+	
+	for header, justify in columns:
+		table.add_column(header, justify = justify)
+	
+	for row in rows:
+		table.add_row(*row)
+	
+	console.print(table)
+	lastUpdateTimeMarkdown = Markdown('**Last update:** ' + formatLastUpdateTime(stateFileLastUpdateTime))
+	console.print(lastUpdateTimeMarkdown)
+
 if __name__ == '__main__':
 	# Set up simple logging:
 	logging.basicConfig(filename = None, level=logging.ERROR)
 	
 	logger = logging.getLogger('main')
 	
+	argumentParser = argparse.ArgumentParser(description = 'List the partitions of the cluster with their current load.')
+	argumentParser.add_argument('--plain', action = 'store_true', help = 'print tab separated plain text instead of a table. This is the default when the output is not a terminal.')
+	arguments = argumentParser.parse_args()
+	
 	# Create a configuration parser and parse the configuration file.
 	configuration = configparser.ConfigParser()
 	
@@ -173,8 +415,8 @@ if __name__ == '__main__':
 			logger.debug('Cannot find configuration value for partitions to ignore, using defaults.')
 			partitionsToIgnore = list() # The default value is an empty list for that.	
 		
-		logger.debug('Got ' + str(len(partitionsToIgnore)) + ' partitions to ignore.')
-		logger.debug('Partition(s) to ignore: ' + str(partitionsToIgnore))
+		logger.debug('Got %d partitions to ignore.', len(partitionsToIgnore))
+		logger.debug('Partition(s) to ignore: %s', partitionsToIgnore)
 		
 		try:		
 			queueStateFilePath = configuration['General']['squeue_state_file_path'].strip()
@@ -182,53 +424,55 @@ if __name__ == '__main__':
 			logger.debug('Cannot find configuration value for squeue state file, using default.')
 			queueStateFilePath = '/var/cache/lssrv/squeue.state' # Use standard file path conventions, keep the system tidy.
 			
-		logger.debug('squeue state file is: ' + str(queueStateFilePath))	
+		logger.debug('squeue state file is: %s', queueStateFilePath)	
+		
+		try:
+			scontrolCacheTimeToLive = int(configuration['General']['scontrol_cache_ttl'])
+		except (KeyError, ValueError) as exception:
+			logger.debug('Cannot find a valid configuration value for scontrol cache TTL, using default.')
+			scontrolCacheTimeToLive = 0 # The cache is per user, so it only helps users running lssrv repeatedly. Keep it opt-in.
+		
+		logger.debug('scontrol cache TTL is: %d', scontrolCacheTimeToLive)
 	else:
 		# Loading all the defaults automatically.
 		partitionsToIgnore = list() # The default value is an empty list for that.
 		queueStateFilePath = '/var/cache/lssrv/squeue.state' # Use standard file path conventions, keep the system tidy. 
+		scontrolCacheTimeToLive = 0 # The cache is per user, so it only helps users running lssrv repeatedly. Keep it opt-in.
 		
 	
-	# Create a rich console.
-	console = Console()
+	# Fall back to plain output when asked, or when nobody is looking at a terminal.
+	usePlainOutput = arguments.plain or not sys.stdout.isatty()
 	
-	with console.status("Please wait while gathering resource information...", spinner = 'line'):
-		allPartitions = getAllPartitions()
-		getJobStateForPartitions(allPartitions, partitionsToIgnore, queueStateFilePath)
-		stateFileLastUpdateTime = os.path.getmtime(queueStateFilePath)
+	if usePlainOutput:
+		gatheringStatus = contextlib.nullcontext()
+	else:
+		from rich.console import Console
+		
+		# Create a rich console.
+		console = Console()
+		gatheringStatus = console.status("Please wait while gathering resource information...", spinner = 'line')
 	
-	# Let's start building our table.
-	table = Table(title = 'TRUBA Partitions State')
-	table.add_column('Partition\nName')
-	table.add_column('CPUs\n(Free)')
-	table.add_column('CPUs\n(Total)')
-	table.add_column('Wait. Jobs\n(Resource)')
-	table.add_column('Wait. Jobs\n(Total)')
-	table.add_column('Nodes\n(Total)')
-	table.add_column('Max Job Time\nDD-HH:MM:SS', justify = 'right')
-	table.add_column('Min. Nodes\nPer Job', justify = 'right')
-	table.add_column('Max. Nodes\nPer Job', justify = 'right')
-	table.add_column('Core\nper Node')
-	table.add_column('RAM\nper Core')
-	
-	# These variables are created here to prevent re-creation in loop continuously.
-	coresPerNode = 0
-	
-	# This is where we add the information we have
-	for partitionName, partitionDetails in allPartitions.items():
-		
-		# If this partition is one of the ones we've been directed to ignore...
-		if partitionName in partitionsToIgnore:
-			continue # Just go on, nothing to see here. 
-		
-		if partitionDetails.homogenous == True:
-			coresPerNode = str(int(int(partitionDetails.TotalCPUs) / int(partitionDetails.TotalNodes))) # Yes, we need all these conversions. All variables are stored as strings, and default Python division is double. So, yes.
-		else:
-			coresPerNode = "-"
+	with gatheringStatus:
+		# Asking Slurm for partitions and reading the state file don't depend on each other. Both wait on I/O, so do them at the same time.
+		with ThreadPoolExecutor(max_workers = 2) as executor:
+			allPartitionsFuture = executor.submit(getAllPartitions, scontrolCacheTimeToLive)
+			queueStateFuture = executor.submit(readQueueState, queueStateFilePath)
+			
+			allPartitions = allPartitionsFuture.result()
+			queueState, stateFileLastUpdateTime = queueStateFuture.result()
 		
-		table.add_row(partitionName, str(int(partitionDetails.TotalCPUs) - partitionDetails.busyCPUCount), partitionDetails.TotalCPUs, str(partitionDetails.pendingJobsPerCategory['Resources']), str(partitionDetails.pendingJobsTotal), partitionDetails.TotalNodes, partitionDetails.MaxTime, partitionDetails.MinNodes, partitionDetails.MaxNodes, coresPerNode, partitionDetails.DefMemPerCPU + ' MB')
+		if queueState is not None:
+			getJobStateForPartitions(allPartitions, partitionsToIgnore, queueState)
 	
+	# This is where we add the information we have. Build all the rows first, then render them in one go.
+	# If a partition is one of the ones we've been directed to ignore, just go on, nothing to see here.
+	rows = [(partitionName, str(partitionDetails.totalCPUCount - partitionDetails.busyCPUCount), partitionDetails.TotalCPUs, str(partitionDetails.pendingJobsPerCategory.get('Resources', 0)), str(partitionDetails.pendingJobsTotal), partitionDetails.TotalNodes, partitionDetails.MaxTime, partitionDetails.MinNodes, partitionDetails.MaxNodes, partitionDetails.coresPerNode, partitionDetails.DefMemPerCPU + ' MB' if partitionDetails.DefMemPerCPU.isdigit() else partitionDetails.DefMemPerCPU) for partitionName, partitionDetails in allPartitions.items() if partitionName not in partitionsToIgnore]
 	
-	console.print(table)
-	lastUpdateTimeMarkdown = Markdown('**Last update:** ' + datetime.fromtimestamp(stateFileLastUpdateTime).strftime('%Y-%m-%d %H:%M:%S'))
-	console.print(lastUpdateTimeMarkdown)
+	# Without the queue state we don't know the load. Don't make the cluster look idle, show it as unknown.
+	if queueState is None:
+		rows = [(row[0], '-', row[2], '-', '-') + row[5:] for row in rows]
+	
+	if usePlainOutput:
+		renderPlain(rows, [header for header, justify in TABLE_COLUMNS], stateFileLastUpdateTime)
+	else:
+		renderRich(console, rows, TABLE_COLUMNS, stateFileLastUpdateTime)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+'''
+Keep the squeue state file of lssrv fresh
+Copyright (C) 2022  Hakan Bayındır
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+@author: Hakan Bayindir
+@contact: hakan.bayindir@tubitak.gov.tr
+@license: GNU/GPLv3
+@version: 0.0.4
+'''
+
+import os
+import time
+import logging
+import tempfile
+import subprocess
+
+import configparser
+
+# This is the same command the cron helper runs. lssrv parses these columns, DO NOT change them.
+SQUEUE_COMMAND = ['squeue', '-O', 'partition,numcpus,state,reason:30', '-h']
+
+def getSqueueCommand(useJobStateCache):
+	''' This function returns the squeue command to run, using the controller's job state cache if asked and supported.'''
+
+	logger = logging.getLogger('getSqueueCommand')
+
+	if not useJobStateCache:
+		return SQUEUE_COMMAND
+
+	# Older squeue versions don't know about this flag. Ask squeue itself instead of parsing version strings.
+	try:
+		squeueHelp = subprocess.run(['squeue', '--help'], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL).stdout
+	except OSError as exception:
+		logger.error('Cannot probe squeue for --only-job-state support: %s', exception)
+		return SQUEUE_COMMAND
+
+	if b'--only-job-state' in squeueHelp:
+		logger.debug('squeue supports --only-job-state, will use the job state cache.')
+		return SQUEUE_COMMAND[:1] + ['--only-job-state'] + SQUEUE_COMMAND[1:]
+
+	logger.warning('squeue does not support --only-job-state, falling back to plain squeue.')
+	return SQUEUE_COMMAND
+
+def hasAllColumns(queueState):
+	''' This function checks whether squeue output carries every column lssrv needs. Empty output can't be judged, so it passes.'''
+
+	for line in queueState.splitlines():
+		fields = line.split()
+
+		if not fields:
+			continue
+
+		# Partition, CPU count, state and reason. Only the first job is checked, the columns are the same for every job.
+		return len(fields) >= 4 and fields[1].isdigit()
+
+	return True
+
+def getQueueState(squeueCommand):
+	''' This function runs squeue and returns its output, falling back to plain squeue if the job state cache leaves columns empty. Returns the output and the command to use next time.'''
+
+	logger = logging.getLogger('getQueueState')
+
+	queueState = subprocess.check_output(squeueCommand)
+
+	# The job state cache may only know job IDs and states. Writing that would show every partition as idle, so stop using it for good.
+	if squeueCommand is not SQUEUE_COMMAND and not hasAllColumns(queueState):
+		logger.warning('squeue --only-job-state does not report all the columns lssrv needs, falling back to plain squeue.')
+		squeueCommand = SQUEUE_COMMAND
+		queueState = subprocess.check_output(squeueCommand)
+
+	return queueState, squeueCommand
+
+def writeQueueState(queueStateFilePath, queueState):
+	''' This function atomically replaces the state file with the given squeue output.'''
+
+	logger = logging.getLogger('writeQueueState')
+
+	# Write next to the real file, so os.replace() stays on the same filesystem and remains atomic.
+	# Readers either see the old state or the new one, never a half written file.
+	temporaryFileDescriptor, temporaryFilePath = tempfile.mkstemp(dir = os.path.dirname(queueStateFilePath), prefix = '.squeue.state.')
+
+	try:
+		with os.fdopen(temporaryFileDescriptor, 'wb') as temporaryFile:
+			temporaryFile.write(queueState)
+
+		# mkstemp creates the file as 0600, but every user needs to read the state.
+		os.chmod(temporaryFilePath, 0o644)
+		os.replace(temporaryFilePath, queueStateFilePath)
+	except OSError:
+		os.unlink(temporaryFilePath)
+		raise
+
+	logger.debug('Wrote %d byte(s) to %s.', len(queueState), queueStateFilePath)
+
+if __name__ == '__main__':
+	# Set up simple logging:
+	logging.basicConfig(filename = None, level=logging.ERROR)
+
+	logger = logging.getLogger('main')
+
+	# Read the same configuration file with lssrv, so both sides agree on the state file.
+	configuration = configparser.ConfigParser()
+	configuration.read('/etc/lssrv.conf')
+
+	queueStateFilePath = configuration.get('General', 'squeue_state_file_path', fallback = '/var/cache/lssrv/squeue.state').strip()
+	refreshInterval = configuration.getint('Cache', 'refresh_interval', fallback = 10)
+	useJobStateCache = configuration.getboolean('Cache', 'use_job_state_cache', fallback = False)
+
+	logger.debug('squeue state file is: %s', queueStateFilePath)
+	logger.debug('Refreshing state every %d second(s).', refreshInterval)
+
+	squeueCommand = getSqueueCommand(useJobStateCache)
+
+	while True:
+		try:
+			queueState, squeueCommand = getQueueState(squeueCommand)
+			writeQueueState(queueStateFilePath, queueState)
+		except subprocess.CalledProcessError as exception:
+			# A busy or restarting controller shouldn't kill the daemon. Keep the old state and try again later.
+			logger.error('Cannot refresh squeue state: %s', exception)
+
+			# The controller may refuse job state cache queries, e.g. when enable_job_state_cache is not set. Don't insist.
+			if squeueCommand is not SQUEUE_COMMAND:
+				logger.warning('squeue --only-job-state failed, falling back to plain squeue.')
+				squeueCommand = SQUEUE_COMMAND
+		except OSError as exception:
+			# Same goes for a missing squeue binary or a full disk.
+			logger.error('Cannot refresh squeue state: %s', exception)
+
+		time.sleep(refreshInterval)